@@ -1,7 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
+from flask.json.provider import JSONProvider
+import orjson
+import os
+import hmac
+import atexit
 import logging
-from database import SessionLocal, init_db
-from client_manager import ClientManager
+import threading
+from collections import defaultdict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Carrega o .env antes dos módulos que leem variáveis de ambiente na importação
+load_dotenv()
+
+from database import SessionLocal, db_session, init_db
+from client_manager import ClientManager, queue_message_log, queue_webhook_log
 from handlers import MessageHandler, CommentHandler, StoryMentionHandler
 from functools import wraps
 
@@ -12,17 +26,107 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """Provider JSON do Flask baseado em orjson (request.get_json e jsonify)"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Inicializa Flask
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Inicializa banco de dados
 init_db()
 logger.info("✅ Sistema multi-tenant inicializado")
 
 
-def get_db_session():
-    """Retorna sessão do banco"""
-    return SessionLocal()
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    """Devolve a sessão do request ao pool ao final de cada request"""
+    db_session.remove()
+
+
+def get_manager() -> ClientManager:
+    """ClientManager do request atual (criado uma vez e guardado em flask.g)"""
+    if 'manager' not in g:
+        g.manager = ClientManager(db_session)
+    return g.manager
+
+
+# ========== PROCESSAMENTO EM BACKGROUND ==========
+
+# Workers para processar eventos de webhook fora do request
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+webhook_executor = ThreadPoolExecutor(
+    max_workers=WEBHOOK_WORKERS,
+    thread_name_prefix='webhook'
+)
+
+# Workers para os envios de um mesmo webhook (um grupo de eventos por conversa)
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', 16))
+send_executor = ThreadPoolExecutor(
+    max_workers=SEND_WORKERS,
+    thread_name_prefix='send'
+)
+
+
+# ========== ESCRITAS EM LOTE ==========
+
+# Intervalo (segundos) entre gravações de dados acumulados em memória
+FLUSH_INTERVAL = float(os.getenv('FLUSH_INTERVAL', 0.1))
+
+_flush_stop = threading.Event()
+_flush_thread = None
+_flush_thread_lock = threading.Lock()
+
+
+def flush_pending_writes():
+    """Grava no banco os dados acumulados em memória (mensagens, webhooks, contadores, last_used_at das API keys)"""
+    with SessionLocal() as db:
+        try:
+            ClientManager(db).flush_pending_writes()
+        except Exception as e:
+            logger.error(f"Erro ao gravar dados pendentes: {e}")
+
+
+def run_flush_loop():
+    """Grava os dados pendentes a cada FLUSH_INTERVAL até o encerramento do processo"""
+    while not _flush_stop.wait(FLUSH_INTERVAL):
+        flush_pending_writes()
+
+
+def shutdown_background_work():
+    """
+    Encerramento do processo: conclui os webhooks e envios em andamento
+    e só então grava o que ficou acumulado em memória
+    """
+    webhook_executor.shutdown(wait=True)
+    send_executor.shutdown(wait=True)
+    _flush_stop.set()
+    if _flush_thread is not None:
+        _flush_thread.join()
+    flush_pending_writes()
+
+
+@app.before_request
+def start_background_jobs():
+    """
+    Inicia a thread de gravação no primeiro request do processo
+    (e não no import, para funcionar com workers forkados pelo gunicorn)
+    """
+    global _flush_thread
+    if _flush_thread is not None:
+        return
+    with _flush_thread_lock:
+        if _flush_thread is None:
+            _flush_thread = threading.Thread(target=run_flush_loop, name='flush', daemon=True)
+            _flush_thread.start()
+            atexit.register(shutdown_background_work)
 
 
 def require_api_key(f):
@@ -34,15 +138,12 @@ def require_api_key(f):
         if not api_key:
             return jsonify({'error': 'API Key required'}), 401
         
-        db = get_db_session()
-        manager = ClientManager(db)
+        manager = get_manager()
         
         client = manager.validate_api_key(api_key)
         if not client:
-            db.close()
             return jsonify({'error': 'Invalid API Key'}), 401
         
-        db.close()
         return f(*args, **kwargs, client=client)
     
     return decorated_function
@@ -77,24 +178,20 @@ def webhook_verify(verify_token):
     token = request.args.get('hub.verify_token')
     challenge = request.args.get('hub.challenge')
     
-    db = get_db_session()
-    manager = ClientManager(db)
+    manager = get_manager()
     
     # Busca cliente pelo verify_token da URL
     client = manager.get_client_by_verify_token(verify_token)
     
     if not client:
         logger.warning(f"Verify token inválido: {verify_token}")
-        db.close()
         return 'Forbidden', 403
     
-    if mode == 'subscribe' and token == verify_token:
+    if mode == 'subscribe' and hmac.compare_digest((token or '').encode(), client.verify_token.encode()):
         logger.info(f"✅ Webhook verificado para cliente {client.id} ({client.name})")
-        db.close()
         return challenge, 200
     else:
         logger.warning(f"Falha na verificação do webhook para cliente {client.id}")
-        db.close()
         return 'Forbidden', 403
 
 
@@ -105,63 +202,98 @@ def webhook_receive(verify_token):
     Roteado automaticamente para o cliente correto
     """
     try:
-        data = request.get_json()
-        
-        db = get_db_session()
-        manager = ClientManager(db)
+        manager = get_manager()
         
-        # Identifica cliente pelo verify_token
+        # Identifica cliente pelo verify_token (normalmente servido do cache)
         client = manager.get_client_by_verify_token(verify_token)
         
         if not client:
             logger.warning(f"Cliente não encontrado para verify_token: {verify_token}")
-            db.close()
             return 'Forbidden', 403
         
         if not client.active:
             logger.warning(f"Cliente {client.id} está desativado")
-            db.close()
             return 'CLIENT_INACTIVE', 200
         
-        logger.info(f"[Cliente {client.id}] Webhook recebido")
-        
-        # Log webhook
-        webhook = manager.log_webhook(
-            event_type='instagram_event',
-            payload=data,
-            client_id=client.id
-        )
+        data = request.get_json()
         
-        # Processa cada entrada
-        if 'entry' in data:
-            for entry in data['entry']:
-                process_entry(entry, client, db, manager)
+        logger.info(f"[Cliente {client.id}] Webhook recebido")
         
-        # Marca webhook como processado
-        manager.mark_webhook_processed(webhook.id)
+        # Processa as entradas em background e responde imediatamente
+        # (o Instagram reenvia o evento se a resposta demorar)
+        future = webhook_executor.submit(process_entries, data, client, datetime.utcnow())
+        future.add_done_callback(log_background_error)
         
-        db.close()
         return 'EVENT_RECEIVED', 200
     
     except Exception as e:
         logger.error(f"Erro ao processar webhook: {e}")
-        if 'db' in locals():
-            db.close()
         return 'ERROR', 500
 
 
-def process_entry(entry, client, db, manager):
-    """Processa cada entrada do webhook para um cliente específico"""
+def log_background_error(future):
+    """Callback dos futures do webhook_executor: registra exceções que escaparam da tarefa"""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Erro não tratado no processamento em background: {future.exception()}", exc_info=future.exception())
+
+
+def process_entries(data, client, received_at):
+    """
+    Processa as entradas de um webhook (executado no pool de workers)
     
-    # Processa mensagens
-    if 'messaging' in entry:
-        for messaging_event in entry['messaging']:
-            process_messaging_event(messaging_event, client, db, manager)
+    Os eventos são agrupados por conversa e os grupos processados em paralelo
+    no send_executor (a latência da Graph API domina cada envio).
+    """
+    error = None
     
-    # Processa comentários
-    if 'changes' in entry:
-        for change in entry['changes']:
-            process_change_event(change, client, db, manager)
+    try:
+        groups = group_events(data)
+        if len(groups) == 1:
+            process_event_group(groups[0], client)
+        elif groups:
+            futures = [send_executor.submit(process_event_group, events, client) for events in groups]
+            for future in futures:
+                future.result()
+    except Exception as e:
+        logger.error(f"[Cliente {client.id}] Erro ao processar webhook: {e}")
+        error = str(e)
+    
+    # Log do webhook (já processado), gravado em lote
+    queue_webhook_log(
+        event_type='instagram_event',
+        payload=data,
+        client_id=client.id,
+        received_at=received_at,
+        error=error
+    )
+
+
+def group_events(data):
+    """
+    Agrupa os eventos do webhook por conversa
+    Mensagens do mesmo remetente ficam no mesmo grupo (em ordem); cada comentário é independente
+    """
+    groups = defaultdict(list)
+    
+    for entry in data.get('entry', []):
+        # Mensagens
+        for messaging_event in entry.get('messaging', []):
+            sender_id = messaging_event.get('sender', {}).get('id')
+            groups[('messaging', sender_id)].append((process_messaging_event, messaging_event))
+        
+        # Comentários
+        for change in entry.get('changes', []):
+            groups[('change', len(groups))].append((process_change_event, change))
+    
+    return list(groups.values())
+
+
+def process_event_group(events, client):
+    """Processa em ordem os eventos de um grupo, com sessão própria"""
+    with SessionLocal() as db:
+        manager = ClientManager(db)
+        for process_event, event in events:
+            process_event(event, client, db, manager)
 
 
 def process_messaging_event(event, client, db, manager):
@@ -182,7 +314,6 @@ def process_messaging_event(event, client, db, manager):
         message_text = message.get('text', '')
         
         if message_text:
-            logger.info(f"[Cliente {client.id}] Nova mensagem de {sender_id}: {message_text}")
             message_handler.process_message(sender_id, message_text)
     
     # Menção em story
@@ -218,13 +349,10 @@ def process_change_event(change, client, db, manager):
 @app.route('/api/clients', methods=['GET'])
 def list_clients():
     """Lista todos os clientes (sem autenticação - para admin)"""
-    db = get_db_session()
-    manager = ClientManager(db)
+    manager = get_manager()
     
-    clients = manager.list_clients(active_only=False)
-    result = [client.to_dict() for client in clients]
+    result = manager.list_client_dicts(active_only=False)
     
-    db.close()
     return jsonify(result)
 
 
@@ -246,8 +374,7 @@ def create_client():
     try:
         data = request.get_json()
         
-        db = get_db_session()
-        manager = ClientManager(db)
+        manager = get_manager()
         
         client = manager.create_client(
             name=data['name'],
@@ -263,39 +390,31 @@ def create_client():
         # Gera API Key para o cliente
         api_key = manager.generate_api_key(client.id, "Initial Key")
         
-        db.close()
-        
         return jsonify({
             'success': True,
             'client': client.to_dict(),
-            'api_key': api_key.key,
+            'api_key': api_key,
             'webhook_url': f'/webhook/{client.verify_token}',
             'verify_token': client.verify_token
         }), 201
     
     except Exception as e:
         logger.error(f"Erro ao criar cliente: {e}")
-        if 'db' in locals():
-            db.close()
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/clients/<int:client_id>', methods=['GET'])
 def get_client(client_id):
     """Obtém detalhes de um cliente"""
-    db = get_db_session()
-    manager = ClientManager(db)
+    manager = get_manager()
     
     client = manager.get_client(client_id)
     
     if not client:
-        db.close()
         return jsonify({'error': 'Client not found'}), 404
     
-    result = client.to_dict()
-    db.close()
-    
-    return jsonify(result)
+    # JSON gerado direto pelo modelo (orjson), sem passar por um dict intermediário
+    return app.response_class(client.to_json(), mimetype='application/json')
 
 
 @app.route('/api/clients/<int:client_id>', methods=['PUT'])
@@ -308,37 +427,29 @@ def update_client(client_id):
     try:
         data = request.get_json()
         
-        db = get_db_session()
-        manager = ClientManager(db)
+        manager = get_manager()
         
         client = manager.update_client(client_id, **data)
         
         if not client:
-            db.close()
             return jsonify({'error': 'Client not found'}), 404
         
         result = client.to_dict()
-        db.close()
         
         return jsonify({'success': True, 'client': result})
     
     except Exception as e:
         logger.error(f"Erro ao atualizar cliente: {e}")
-        if 'db' in locals():
-            db.close()
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/clients/<int:client_id>', methods=['DELETE'])
 def delete_client(client_id):
     """Desativa cliente (soft delete)"""
-    db = get_db_session()
-    manager = ClientManager(db)
+    manager = get_manager()
     
     success = manager.deactivate_client(client_id)
     
-    db.close()
-    
     if success:
         return jsonify({'success': True, 'message': 'Client deactivated'})
     else:
@@ -348,13 +459,10 @@ def delete_client(client_id):
 @app.route('/api/clients/<int:client_id>/stats', methods=['GET'])
 def get_client_stats(client_id):
     """Obtém estatísticas do cliente"""
-    db = get_db_session()
-    manager = ClientManager(db)
+    manager = get_manager()
     
     stats = manager.get_client_stats(client_id)
     
-    db.close()
-    
     if not stats:
         return jsonify({'error': 'Client not found'}), 404
     
@@ -364,13 +472,10 @@ def get_client_stats(client_id):
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check para monitoramento"""
-    db = get_db_session()
-    manager = ClientManager(db)
+    manager = get_manager()
     
-    total_clients = len(manager.list_clients(active_only=False))
-    active_clients = len(manager.list_clients(active_only=True))
-    
-    db.close()
+    total_clients = manager.count_clients(active_only=False)
+    active_clients = manager.count_clients(active_only=True)
     
     return jsonify({
         'status': 'healthy',
@@ -392,17 +497,19 @@ def send_message(client):
     try:
         data = request.get_json()
         
-        db = get_db_session()
-        manager = ClientManager(db)
+        manager = get_manager()
         
-        message_handler = MessageHandler(client, db, manager)
+        message_handler = MessageHandler(client, db_session, manager)
         
         recipient_id = data['recipient_id']
         message_text = data['message']
         
+        if not manager.check_rate_limit(client.id):
+            return jsonify({'error': 'Limite diário de mensagens excedido'}), 429
+        
         result = message_handler.api.send_message(recipient_id, message_text)
         
-        manager.log_message(
+        queue_message_log(
             client_id=client.id,
             recipient_id=recipient_id,
             message_type='dm',
@@ -410,25 +517,21 @@ def send_message(client):
             sent=bool(result)
         )
         
-        db.close()
-        
         return jsonify({'success': True, 'result': result})
     
     except Exception as e:
         logger.error(f"Erro ao enviar mensagem: {e}")
-        if 'db' in locals():
-            db.close()
         return jsonify({'error': str(e)}), 500
 
 
 if __name__ == '__main__':
-    import os
     port = int(os.getenv('PORT', 5000))
     
     logger.info(f"🚀 Iniciando servidor multi-tenant na porta {port}")
     
+    # Servidor de desenvolvimento; em produção use: gunicorn -c gunicorn_conf.py app:app
     app.run(
         host='0.0.0.0',
         port=port,
-        debug=True
+        debug=os.getenv('FLASK_DEBUG', '0') == '1'
     )
@@ -1,13 +1,239 @@
 import secrets
+import os
+import queue
+import hashlib
 import logging
+import threading
+from collections import Counter, defaultdict, namedtuple
 from datetime import datetime, timedelta
+from cachetools import TTLCache
+from sqlalchemy import and_, bindparam, case, event, func, insert, inspect, or_, select
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
 from sqlalchemy.orm import Session
-from models import Client, Message, Webhook, ApiKey
+from models import Client, Message, Webhook, ApiKey, hash_verify_token
 from typing import Optional, List, Dict
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cópia leve dos dados do cliente, segura para uso depois que a sessão fecha
+ClientSnapshot = namedtuple('ClientSnapshot', [
+    'id', 'name', 'email', 'access_token', 'instagram_account_id', 'page_id',
+    'verify_token', 'keywords', 'custom_responses', 'auto_reply_enabled',
+    'active', 'daily_message_limit'
+])
+
+# Cache de API keys validadas: hash da key -> (api_key_id, ClientSnapshot)
+_API_KEY_CACHE = TTLCache(maxsize=10_000, ttl=60)
+# Último uso pendente de cada API key (api_key_id -> datetime), gravado em lote
+_API_KEY_USAGE = {}
+# Incrementos de contadores ainda não gravados (client_id -> Counter por coluna), gravados em lote
+_COUNTER_DELTAS = defaultdict(Counter)
+# Colunas de Client mantidas como contadores incrementais
+COUNTER_COLUMNS = ('total_messages', 'webhooks_received')
+# Webhooks já processados aguardando gravação em lote (dicts de colunas de Webhook)
+_WEBHOOK_LOG_QUEUE = queue.SimpleQueue()
+# Mensagens enviadas aguardando gravação em lote (dicts de colunas de Message)
+_MESSAGE_LOG_QUEUE = queue.SimpleQueue()
+# Cache de clientes por ID: client_id -> ClientSnapshot
+_CLIENT_CACHE = TTLCache(maxsize=10_000, ttl=60)
+# Cache de verify_token (webhooks) -> client_id
+_VERIFY_TOKEN_CACHE = TTLCache(maxsize=4096, ttl=300)
+# Cache de estatísticas: (client_id, data) -> dict
+_STATS_CACHE = TTLCache(maxsize=4096, ttl=60)
+# Clientes que já esgotaram o limite diário: (client_id, data) -> True
+_RATE_LIMITED = TTLCache(maxsize=4096, ttl=60)
+_CACHE_LOCK = threading.RLock()
+
+
+# Chave do hash das API keys, derivada de API_KEY_SECRET (trocar o segredo invalida todas as keys)
+API_KEY_SECRET = os.getenv('API_KEY_SECRET', '')
+if not API_KEY_SECRET:
+    logger.warning("⚠️ API_KEY_SECRET não definido: o hash das API keys usa um segredo vazio")
+_API_KEY_HASH_KEY = hashlib.blake2b(API_KEY_SECRET.encode()).digest()
+
+
+def hash_api_key(key: str) -> str:
+    """Hash BLAKE2b (com segredo) da API key: é o que fica no banco e no cache"""
+    return hashlib.blake2b(key.encode(), digest_size=16, key=_API_KEY_HASH_KEY).hexdigest()
+
+
+def normalize_keywords(keywords: List[str]) -> List[str]:
+    """Keywords em minúsculas e sem espaços extras (feito uma vez, ao gravar)"""
+    return [k.strip().lower() for k in keywords or [] if k and k.strip()]
+
+
+def _drain_queue(pending: queue.SimpleQueue) -> list:
+    """Retira da fila, sem bloquear, todos os itens pendentes"""
+    batch = []
+    while True:
+        try:
+            batch.append(pending.get_nowait())
+        except queue.Empty:
+            return batch
+
+
+def _requeue(pending: queue.SimpleQueue, rows: list):
+    """Devolve à fila registros que não puderam ser gravados"""
+    for row in rows:
+        pending.put(row)
+
+
+def _is_row_error(error: Exception) -> bool:
+    """
+    Erro causado pelo conteúdo de um registro (viola constraint, valor inválido,
+    parâmetro que não pôde ser convertido), e não pelo banco ou pela conexão
+    """
+    if isinstance(error, (IntegrityError, DataError)):
+        return True
+    # StatementError também é a base de todos os erros do driver (DBAPIError)
+    return isinstance(error, StatementError) and not isinstance(error, DBAPIError)
+
+
+def _count_rows(rows: list, column: str):
+    """Soma aos contadores pendentes um incremento por registro gravado (por client_id)"""
+    with _CACHE_LOCK:
+        for row in rows:
+            if row['client_id']:
+                _COUNTER_DELTAS[row['client_id']][column] += 1
+
+
+def queue_message_log(
+    client_id: int,
+    recipient_id: str,
+    message_type: str,
+    message_text: str = None,
+    media_url: str = None,
+    sent: bool = True,
+    error: str = None
+):
+    """
+    Registra mensagem enviada sem acessar o banco
+    
+    O registro fica em memória e é gravado em lote por ClientManager.flush_message_logs(),
+    que também soma total_messages (só para mensagens de fato gravadas).
+    """
+    _MESSAGE_LOG_QUEUE.put({
+        'client_id': client_id,
+        'recipient_id': recipient_id,
+        'message_type': message_type,
+        'message_text': message_text,
+        'media_url': media_url,
+        'sent': sent,
+        'error': error,
+        'created_at': datetime.utcnow()
+    })
+
+
+def queue_webhook_log(
+    event_type: str,
+    payload: dict,
+    client_id: int = None,
+    received_at: datetime = None,
+    error: str = None
+):
+    """
+    Registra webhook já processado sem acessar o banco
+    
+    O registro fica em memória e é gravado em lote por ClientManager.flush_webhook_logs(),
+    que também soma webhooks_received (só para webhooks de fato gravados).
+    """
+    _WEBHOOK_LOG_QUEUE.put({
+        'client_id': client_id,
+        'event_type': event_type,
+        'payload': payload,
+        'processed': True,
+        'error': error,
+        'received_at': received_at or datetime.utcnow(),
+        'processed_at': datetime.utcnow()
+    })
+
+
+def _snapshot(client: Client) -> ClientSnapshot:
+    """Copia os campos usados fora da sessão (handlers, InstagramAPI)"""
+    return ClientSnapshot(
+        id=client.id,
+        name=client.name,
+        email=client.email,
+        access_token=client.access_token,
+        instagram_account_id=client.instagram_account_id,
+        page_id=client.page_id,
+        verify_token=client.verify_token,
+        keywords=tuple(client.keywords or ()),
+        custom_responses=dict(client.custom_responses or {}),
+        auto_reply_enabled=client.auto_reply_enabled,
+        active=client.active,
+        daily_message_limit=client.daily_message_limit
+    )
+
+
+def _pending_evictions(session: Session) -> dict:
+    """Entradas de cache a descartar quando a transação da sessão for confirmada"""
+    return session.info.setdefault('cache_evictions', {
+        'clients': set(), 'verify_tokens': set(), 'api_keys': set()
+    })
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_cache_evictions(session, flush_context):
+    """
+    Anota as entradas de cache afetadas por clientes/API keys alterados ou removidos
+    
+    O descarte só acontece em after_commit: se fosse feito aqui (antes do COMMIT),
+    um request concorrente poderia recolocar no cache a versão antiga, ainda visível.
+    """
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ApiKey):
+            history = inspect(obj).attrs.key_hash.history
+            _pending_evictions(session)['api_keys'].update(
+                [obj.key_hash, *history.deleted]
+            )
+        
+        elif isinstance(obj, Client):
+            state = inspect(obj)
+            if obj not in session.deleted and not any(
+                state.attrs[field].history.has_changes() for field in ClientSnapshot._fields
+            ):
+                # Só contadores mudaram (ex: total_messages): snapshots continuam válidos
+                continue
+            
+            evictions = _pending_evictions(session)
+            evictions['clients'].add(obj.id)
+            # Token atual e anterior (caso o verify_token tenha sido trocado)
+            evictions['verify_tokens'].update(
+                [obj.verify_token, *state.attrs.verify_token.history.deleted]
+            )
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_cache_evictions(session):
+    """Descarta do cache o que foi alterado pela transação recém-confirmada"""
+    evictions = session.info.pop('cache_evictions', None)
+    if not evictions:
+        return
+    
+    today = datetime.utcnow().date()
+    with _CACHE_LOCK:
+        for key_hash in evictions['api_keys']:
+            _API_KEY_CACHE.pop(key_hash, None)
+        for verify_token in evictions['verify_tokens']:
+            _VERIFY_TOKEN_CACHE.pop(verify_token, None)
+        
+        client_ids = evictions['clients']
+        for client_id in client_ids:
+            _CLIENT_CACHE.pop(client_id, None)
+            _STATS_CACHE.pop((client_id, today), None)
+            _RATE_LIMITED.pop((client_id, today), None)
+        if client_ids:
+            stale = [h for h, (_, snap) in _API_KEY_CACHE.items() if snap.id in client_ids]
+            for h in stale:
+                _API_KEY_CACHE.pop(h, None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_cache_evictions(session):
+    """Transação desfeita: nada mudou no banco, o cache continua válido"""
+    session.info.pop('cache_evictions', None)
+
 
 class ClientManager:
     """Gerenciador de clientes do sistema multi-tenant"""
@@ -59,7 +285,7 @@ class ClientManager:
                 instagram_account_id=instagram_account_id,
                 page_id=page_id,
                 verify_token=verify_token,
-                keywords=keywords or [],
+                keywords=normalize_keywords(keywords),
                 custom_responses=custom_responses or {},
                 daily_message_limit=daily_limit
             )
@@ -77,8 +303,8 @@ class ClientManager:
             raise
     
     def get_client(self, client_id: int) -> Optional[Client]:
-        """Busca cliente por ID"""
-        return self.db.query(Client).filter(Client.id == client_id).first()
+        """Busca cliente por ID (reaproveita o objeto já carregado na sessão)"""
+        return self.db.get(Client, client_id)
     
     def get_client_by_email(self, email: str) -> Optional[Client]:
         """Busca cliente por email"""
@@ -90,11 +316,55 @@ class ClientManager:
             Client.instagram_account_id == instagram_account_id
         ).first()
     
-    def get_client_by_verify_token(self, verify_token: str) -> Optional[Client]:
-        """Busca cliente por verify token (usado em webhooks)"""
-        return self.db.query(Client).filter(
-            Client.verify_token == verify_token
+    def get_client_cached(self, client_id: int) -> Optional[ClientSnapshot]:
+        """
+        Busca snapshot do cliente por ID
+        
+        Resultados ficam em cache por 60s; alterações no cliente
+        (update_client, deactivate_client...) invalidam a entrada automaticamente.
+        """
+        with _CACHE_LOCK:
+            cached = _CLIENT_CACHE.get(client_id)
+        if cached:
+            return cached
+        
+        client = self.get_client(client_id)
+        if not client:
+            return None
+        
+        snapshot = _snapshot(client)
+        with _CACHE_LOCK:
+            _CLIENT_CACHE[client_id] = snapshot
+        return snapshot
+    
+    def get_client_by_verify_token(self, verify_token: str) -> Optional[ClientSnapshot]:
+        """
+        Busca cliente por verify token (usado em webhooks)
+        
+        O ID do cliente fica em cache por 5 minutos e o snapshot
+        vem de get_client_cached(). Se o token do snapshot não for mais o
+        buscado (trocado em outro processo), a entrada é descartada.
+        """
+        with _CACHE_LOCK:
+            client_id = _VERIFY_TOKEN_CACHE.get(verify_token)
+        if client_id is not None:
+            snapshot = self.get_client_cached(client_id)
+            if snapshot and snapshot.verify_token == verify_token:
+                return snapshot
+            with _CACHE_LOCK:
+                _VERIFY_TOKEN_CACHE.pop(verify_token, None)
+        
+        client = self.db.query(Client).filter(
+            Client.verify_token_hash == hash_verify_token(verify_token)
         ).first()
+        if not client:
+            return None
+        
+        snapshot = _snapshot(client)
+        with _CACHE_LOCK:
+            _VERIFY_TOKEN_CACHE[verify_token] = client.id
+            _CLIENT_CACHE[client.id] = snapshot
+        return snapshot
     
     def list_clients(self, active_only: bool = True) -> List[Client]:
         """Lista todos os clientes"""
@@ -103,6 +373,29 @@ class ClientManager:
             query = query.filter(Client.active == True)
         return query.all()
     
+    def list_client_dicts(self, active_only: bool = True) -> List[Dict]:
+        """
+        Lista clientes já no formato de Client.to_dict()
+        Seleciona só as colunas expostas, sem materializar objetos ORM
+        """
+        query = select(*(getattr(Client, field) for field in Client.API_FIELDS))
+        if active_only:
+            query = query.where(Client.active == True)
+        
+        result = []
+        for row in self.db.execute(query):
+            data = dict(row._mapping)
+            data['created_at'] = data['created_at'].isoformat() if data['created_at'] else None
+            result.append(data)
+        return result
+    
+    def count_clients(self, active_only: bool = True) -> int:
+        """Conta clientes com um único SELECT COUNT"""
+        query = select(func.count(Client.id))
+        if active_only:
+            query = query.where(Client.active == True)
+        return self.db.execute(query).scalar()
+    
     def update_client(self, client_id: int, **kwargs) -> Optional[Client]:
         """
         Atualiza dados do cliente
@@ -117,6 +410,9 @@ class ClientManager:
                 logger.warning(f"Cliente {client_id} não encontrado")
                 return None
             
+            if 'keywords' in kwargs:
+                kwargs['keywords'] = normalize_keywords(kwargs['keywords'])
+            
             for key, value in kwargs.items():
                 if hasattr(client, key):
                     setattr(client, key, value)
@@ -169,170 +465,293 @@ class ClientManager:
             logger.error(f"❌ Erro ao deletar cliente: {e}")
             return False
     
+    def is_rate_limited(self, client_id: int) -> bool:
+        """
+        Verificação só em memória: True se o cliente já esgotou o limite hoje
+        Não reserva envio; False não garante que ainda há limite (use check_rate_limit)
+        """
+        with _CACHE_LOCK:
+            return (client_id, datetime.utcnow().date()) in _RATE_LIMITED
+    
     def check_rate_limit(self, client_id: int) -> bool:
         """
-        Verifica se cliente ainda pode enviar mensagens hoje
+        Reserva o envio de uma mensagem no limite diário do cliente
+        
+        Um único UPDATE atômico zera o contador em um novo dia, verifica o
+        limite e já contabiliza a mensagem, sem corrida entre workers.
+        Deve ser chamado imediatamente antes do envio.
         
         Returns:
-            True se ainda pode enviar, False se excedeu limite
+            True se ainda pode enviar (mensagem já contabilizada), False se excedeu limite
         """
-        client = self.get_client(client_id)
-        if not client:
+        # Limite já esgotado hoje: o contador só cresce até a virada do dia, então
+        # não é preciso ir ao banco (a entrada expira em 60s ou quando o cliente é alterado)
+        if self.is_rate_limited(client_id):
             return False
         
-        # Reset contador se for novo dia
-        today = datetime.utcnow().date()
-        last_reset = client.last_reset_date.date() if client.last_reset_date else None
+        table = Client.__table__
+        now = datetime.utcnow()
+        today_start = datetime.combine(now.date(), datetime.min.time())
+        new_day = or_(table.c.last_reset_date == None, table.c.last_reset_date < today_start)
         
-        if last_reset != today:
-            client.messages_sent_today = 0
-            client.last_reset_date = datetime.utcnow()
+        try:
+            result = self.db.execute(
+                table.update()
+                .where(
+                    table.c.id == client_id,
+                    or_(
+                        and_(new_day, table.c.daily_message_limit > 0),
+                        table.c.messages_sent_today < table.c.daily_message_limit
+                    )
+                )
+                .values(
+                    messages_sent_today=case((new_day, 1), else_=table.c.messages_sent_today + 1),
+                    last_reset_date=case((new_day, now), else_=table.c.last_reset_date)
+                )
+            )
             self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"❌ Erro ao verificar rate limit: {e}")
+            raise
+        
+        if result.rowcount == 1:
+            return True
         
-        # Verifica limite
-        return client.messages_sent_today < client.daily_message_limit
+        with _CACHE_LOCK:
+            _RATE_LIMITED[(client_id, now.date())] = True
+        return False
     
-    def increment_message_count(self, client_id: int):
-        """Incrementa contador de mensagens enviadas"""
-        client = self.get_client(client_id)
-        if client:
-            client.messages_sent_today += 1
-            self.db.commit()
+    def _pending_counters(self, client_id: int) -> Counter:
+        """Incrementos ainda não gravados de um cliente"""
+        with _CACHE_LOCK:
+            return Counter(_COUNTER_DELTAS.get(client_id, {}))
     
-    def log_message(
-        self,
-        client_id: int,
-        recipient_id: str,
-        message_type: str,
-        message_text: str = None,
-        media_url: str = None,
-        sent: bool = True,
-        error: str = None
-    ) -> Message:
-        """Registra mensagem enviada no histórico"""
+    def flush_counters(self) -> int:
+        """Grava em lote os incrementos de contadores pendentes. Retorna quantos clientes foram atualizados"""
+        with _CACHE_LOCK:
+            pending = list(_COUNTER_DELTAS.items())
+            _COUNTER_DELTAS.clear()
+        
+        if not pending:
+            return 0
+        
+        table = Client.__table__
         try:
-            message = Message(
-                client_id=client_id,
-                recipient_id=recipient_id,
-                message_type=message_type,
-                message_text=message_text,
-                media_url=media_url,
-                sent=sent,
-                error=error
+            self.db.execute(
+                table.update()
+                .where(table.c.id == bindparam('client_id'))
+                .values({
+                    column: table.c[column] + bindparam(f'delta_{column}')
+                    for column in COUNTER_COLUMNS
+                }),
+                [
+                    {'client_id': client_id, **{f'delta_{column}': deltas[column] for column in COUNTER_COLUMNS}}
+                    for client_id, deltas in pending
+                ]
             )
-            
-            self.db.add(message)
             self.db.commit()
-            
-            if sent:
-                self.increment_message_count(client_id)
-            
-            return message
-        
         except Exception as e:
             self.db.rollback()
-            logger.error(f"❌ Erro ao registrar mensagem: {e}")
+            # Devolve os incrementos (somando aos que chegaram nesse meio tempo)
+            with _CACHE_LOCK:
+                for client_id, deltas in pending:
+                    _COUNTER_DELTAS[client_id].update(deltas)
+            logger.error(f"❌ Erro ao gravar contadores (mantidos para nova tentativa): {e}")
             raise
+        
+        return len(pending)
     
-    def log_webhook(
-        self,
-        event_type: str,
-        payload: dict,
-        client_id: int = None
-    ) -> Webhook:
-        """Registra webhook recebido"""
+    def flush_pending_writes(self):
+        """Grava todos os dados acumulados em memória (mensagens, webhooks, contadores e uso de API keys)"""
+        self.flush_message_logs()
+        self.flush_webhook_logs()
+        self.flush_counters()
+        self.flush_api_key_usage()
+    
+    def _flush_log_queue(self, pending: queue.SimpleQueue, write, label: str) -> list:
+        """
+        Grava em lote os registros de uma fila. Retorna os registros gravados
+        
+        Erro de um registro (ex.: viola NOT NULL): regrava linha a linha e
+        descarta, com log, apenas os registros inválidos. Qualquer outro erro
+        (conexão, permissão, coluna ausente, transação somente leitura) afeta
+        todas as linhas: o lote volta para a fila e o erro é propagado.
+        """
+        batch = _drain_queue(pending)
+        if not batch:
+            return []
+        
         try:
-            webhook = Webhook(
-                client_id=client_id,
-                event_type=event_type,
-                payload=payload
-            )
-            
-            self.db.add(webhook)
+            write(batch)
             self.db.commit()
-            
-            return webhook
-        
+            return batch
         except Exception as e:
             self.db.rollback()
-            logger.error(f"❌ Erro ao registrar webhook: {e}")
-            raise
+            if not _is_row_error(e):
+                _requeue(pending, batch)
+                logger.error(f"❌ Erro ao gravar {len(batch)} {label} (mantidos para nova tentativa): {e}")
+                raise
+            logger.error(f"❌ Erro ao gravar {len(batch)} {label} em lote, gravando um a um: {e}")
+        
+        saved = []
+        for index, row in enumerate(batch):
+            try:
+                write([row])
+                self.db.commit()
+                saved.append(row)
+            except Exception as e:
+                self.db.rollback()
+                if not _is_row_error(e):
+                    _requeue(pending, batch[index:])
+                    logger.error(f"❌ Erro ao gravar {label} (mantidos para nova tentativa): {e}")
+                    raise
+                logger.error(f"❌ Registro descartado ({label}): {row!r} - {e}")
+        
+        return saved
     
-    def mark_webhook_processed(self, webhook_id: int, error: str = None):
-        """Marca webhook como processado"""
-        webhook = self.db.query(Webhook).filter(Webhook.id == webhook_id).first()
-        if webhook:
-            webhook.processed = True
-            webhook.processed_at = datetime.utcnow()
-            if error:
-                webhook.error = error
-            self.db.commit()
+    def flush_message_logs(self) -> int:
+        """Grava em lote as mensagens pendentes (um único INSERT executemany). Retorna quantas foram gravadas"""
+        saved = self._flush_log_queue(
+            _MESSAGE_LOG_QUEUE,
+            lambda rows: self.db.execute(insert(Message), rows),
+            'mensagens'
+        )
+        _count_rows(saved, 'total_messages')
+        return len(saved)
+    
+    def flush_webhook_logs(self) -> int:
+        """Grava em lote os webhooks pendentes. Retorna quantos foram gravados"""
+        saved = self._flush_log_queue(
+            _WEBHOOK_LOG_QUEUE,
+            lambda rows: self.db.bulk_insert_mappings(Webhook, rows),
+            'webhooks'
+        )
+        _count_rows(saved, 'webhooks_received')
+        return len(saved)
     
-    def generate_api_key(self, client_id: int, name: str = "Default") -> ApiKey:
-        """Gera API key para autenticação do cliente"""
+    def generate_api_key(self, client_id: int, name: str = "Default") -> str:
+        """
+        Gera API key para autenticação do cliente
+        
+        Returns:
+            A key gerada. Só o hash é armazenado, então ela não pode ser recuperada depois.
+        """
         try:
             key = f"sk_{secrets.token_urlsafe(48)}"
             
-            api_key = ApiKey(
-                client_id=client_id,
-                key=key,
-                name=name
+            self.db.execute(
+                insert(ApiKey).values({
+                    ApiKey.client_id: client_id,
+                    ApiKey.key_hash: hash_api_key(key),  # Atributo mapeado para a coluna "key"
+                    ApiKey.name: name
+                })
             )
-            
-            self.db.add(api_key)
             self.db.commit()
-            self.db.refresh(api_key)
             
             logger.info(f"✅ API Key gerada para cliente {client_id}")
-            return api_key
+            return key
         
         except Exception as e:
             self.db.rollback()
             logger.error(f"❌ Erro ao gerar API key: {e}")
             raise
     
-    def validate_api_key(self, key: str) -> Optional[Client]:
-        """Valida API key e retorna cliente associado"""
-        api_key = self.db.query(ApiKey).filter(
-            ApiKey.key == key,
-            ApiKey.active == True
+    def validate_api_key(self, key: str) -> Optional[ClientSnapshot]:
+        """
+        Valida API key e retorna snapshot do cliente associado
+        
+        Keys válidas ficam em cache por 60s; o last_used_at é registrado em
+        memória e gravado em lote por flush_api_key_usage().
+        """
+        key_hash = hash_api_key(key)
+        
+        with _CACHE_LOCK:
+            cached = _API_KEY_CACHE.get(key_hash)
+            if cached:
+                api_key_id, client = cached
+                _API_KEY_USAGE[api_key_id] = datetime.utcnow()
+                return client
+        
+        # Key e cliente em uma única consulta
+        row = self.db.execute(
+            select(ApiKey.id, Client)
+            .join(Client, Client.id == ApiKey.client_id)
+            .where(
+                ApiKey.key_hash == key_hash,
+                ApiKey.active == True,
+                Client.active == True
+            )
         ).first()
         
-        if not api_key:
+        if not row:
             return None
         
-        # Atualiza último uso
-        api_key.last_used_at = datetime.utcnow()
-        self.db.commit()
+        api_key_id, client = row
+        snapshot = _snapshot(client)
+        with _CACHE_LOCK:
+            _API_KEY_CACHE[key_hash] = (api_key_id, snapshot)
+            _API_KEY_USAGE[api_key_id] = datetime.utcnow()
+        
+        return snapshot
+    
+    def flush_api_key_usage(self) -> int:
+        """Grava em lote os last_used_at pendentes. Retorna quantas keys foram atualizadas"""
+        with _CACHE_LOCK:
+            pending = list(_API_KEY_USAGE.items())
+            _API_KEY_USAGE.clear()
+        
+        if not pending:
+            return 0
+        
+        table = ApiKey.__table__
+        try:
+            self.db.execute(
+                table.update()
+                .where(table.c.id == bindparam('key_id'))
+                .values(last_used_at=bindparam('used_at')),
+                [{'key_id': key_id, 'used_at': used_at} for key_id, used_at in pending]
+            )
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            # Devolve os registros, sem sobrescrever usos mais recentes
+            with _CACHE_LOCK:
+                for key_id, used_at in pending:
+                    _API_KEY_USAGE.setdefault(key_id, used_at)
+            logger.error(f"❌ Erro ao gravar uso de API keys (mantidos para nova tentativa): {e}")
+            raise
         
-        return self.get_client(api_key.client_id)
+        return len(pending)
     
     def get_client_stats(self, client_id: int) -> Dict:
-        """Retorna estatísticas do cliente"""
+        """Retorna estatísticas do cliente (em cache por 60s)"""
+        cache_key = (client_id, datetime.utcnow().date())
+        with _CACHE_LOCK:
+            cached = _STATS_CACHE.get(cache_key)
+        if cached:
+            return cached
+        
         client = self.get_client(client_id)
         if not client:
             return {}
         
-        total_messages = self.db.query(Message).filter(
-            Message.client_id == client_id
-        ).count()
-        
-        messages_today = self.db.query(Message).filter(
-            Message.client_id == client_id,
-            Message.created_at >= datetime.utcnow().date()
-        ).count()
-        
-        webhooks_received = self.db.query(Webhook).filter(
-            Webhook.client_id == client_id
-        ).count()
+        # Contadores mantidos no próprio cliente + incrementos ainda não gravados
+        pending = self._pending_counters(client_id)
+        last_reset = client.last_reset_date.date() if client.last_reset_date else None
+        messages_today = client.messages_sent_today if last_reset == cache_key[1] else 0
         
-        return {
+        stats = {
             'client_id': client_id,
             'name': client.name,
-            'total_messages': total_messages,
+            'total_messages': client.total_messages + pending['total_messages'],
             'messages_today': messages_today,
-            'webhooks_received': webhooks_received,
+            'webhooks_received': client.webhooks_received + pending['webhooks_received'],
             'active': client.active,
             'daily_limit': client.daily_message_limit,
-            'limit_remaining': client.daily_message_limit - client.messages_sent_today
+            'limit_remaining': client.daily_message_limit - messages_today
         }
+        
+        with _CACHE_LOCK:
+            _STATS_CACHE[cache_key] = stats
+        return stats
@@ -1,34 +1,224 @@
 import os
-from sqlalchemy import create_engine
+import orjson
+from sqlalchemy import create_engine, event, inspect, select, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, scoped_session
-from models import Base
+from models import Base, ApiKey, Client, hash_verify_token
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# SQL só é logado com echo=True; mantém o logger do engine em WARNING mesmo com o root em INFO/DEBUG
+logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
 
 # Database URL - pode ser SQLite (dev) ou PostgreSQL (prod)
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///instagram_agent.db')
 
+# Opções do engine
+engine_options = {
+    'echo': False,  # True para debug SQL
+    'pool_pre_ping': True,  # Verifica conexão antes de usar
+    # Colunas JSON (payload, keywords, custom_responses) serializadas com orjson
+    'json_serializer': lambda obj: orjson.dumps(obj).decode(),
+    'json_deserializer': orjson.loads,
+}
+
+if 'sqlite' in DATABASE_URL:
+    engine_options['connect_args'] = {
+        'check_same_thread': False,
+        'timeout': 30  # Aguarda o lock de escrita em vez de falhar com "database is locked"
+    }
+    if make_url(DATABASE_URL).database not in (None, '', ':memory:'):
+        # Arquivo SQLite: reaproveita conexões (e seus PRAGMAs) em vez de abrir uma por sessão
+        engine_options['poolclass'] = QueuePool
+else:
+    # Pool de conexões por processo (gunicorn: multiplicado pelo número de workers)
+    # As threads só seguram uma conexão entre a consulta e o commit, não durante as
+    # chamadas à Graph API, então um pool menor que o total de threads é suficiente
+    engine_options.update(
+        pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 5)),
+        pool_timeout=30,  # Segundos aguardando conexão livre
+        pool_recycle=1800  # Renova conexões a cada 30 min
+    )
+
+if make_url(DATABASE_URL).get_driver_name() == 'psycopg2':
+    # Lotes em poucos round-trips: INSERTs via execute_values (log de mensagens/webhooks)
+    # e UPDATEs via execute_batch (contadores e last_used_at das API keys)
+    engine_options.update(
+        executemany_mode='values_plus_batch',
+        executemany_values_page_size=1000,
+        executemany_batch_page_size=500
+    )
+
 # Cria engine
-engine = create_engine(
-    DATABASE_URL,
-    echo=False,  # True para debug SQL
-    pool_pre_ping=True,  # Verifica conexão antes de usar
-    connect_args={'check_same_thread': False} if 'sqlite' in DATABASE_URL else {}
-)
+engine = create_engine(DATABASE_URL, **engine_options)
+
+
+@event.listens_for(engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    SQLite: WAL permite leituras concorrentes com uma escrita, e
+    synchronous=NORMAL evita um fsync por commit (seguro com WAL)
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    cursor.close()
 
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Scoped session para thread-safety
+# Scoped session para thread-safety (uma sessão por thread/request)
 db_session = scoped_session(SessionLocal)
 
 
+# Preenche colunas novas a partir dos dados já existentes
+COLUMN_BACKFILLS = {
+    ('clients', 'total_messages'):
+        "UPDATE clients SET total_messages = "
+        "(SELECT COUNT(*) FROM messages WHERE messages.client_id = clients.id)",
+    ('clients', 'webhooks_received'):
+        "UPDATE clients SET webhooks_received = "
+        "(SELECT COUNT(*) FROM webhooks WHERE webhooks.client_id = clients.id)",
+}
+
+
+def add_missing_columns():
+    """
+    Adiciona colunas declaradas nos modelos que ainda não existem no banco
+    (create_all não altera tabelas que já existem)
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+                
+                backfill = COLUMN_BACKFILLS.get((table.name, column.name))
+                if backfill:
+                    conn.execute(text(backfill))
+                logger.info(f"🧱 Coluna {column.name} adicionada em {table.name}")
+
+
+def create_missing_indexes():
+    """
+    Cria índices declarados nos modelos que ainda não existem no banco
+    (create_all não altera tabelas que já existem)
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                logger.info(f"📇 Índice {index.name} criado em {table.name}")
+
+
+# Colunas JSONB no PostgreSQL (bancos criados antes têm essas colunas como JSON)
+POSTGRES_JSONB_COLUMNS = (('clients', 'keywords'), ('clients', 'custom_responses'))
+
+
+def upgrade_postgres_json_columns():
+    """PostgreSQL: converte as colunas JSON antigas para JSONB"""
+    if engine.dialect.name != 'postgresql':
+        return
+    
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name, column_name in POSTGRES_JSONB_COLUMNS:
+            column = next(c for c in inspector.get_columns(table_name) if c['name'] == column_name)
+            if not isinstance(column['type'], JSONB):
+                conn.execute(text(
+                    f"ALTER TABLE {table_name} ALTER COLUMN {column_name} TYPE jsonb USING {column_name}::jsonb"
+                ))
+                logger.info(f"🧱 Coluna {column_name} convertida para JSONB em {table_name}")
+
+
+def hash_plaintext_api_keys():
+    """
+    Substitui API keys antigas gravadas em texto puro pelo hash
+    
+    Sem API_KEY_SECRET a conversão é adiada: o hash feito com segredo vazio
+    invalidaria todas essas keys assim que o segredo fosse definido.
+    """
+    from client_manager import API_KEY_SECRET, hash_api_key
+    
+    table = ApiKey.__table__
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(table.c.id, table.c.key).where(table.c.key.like('sk_%'))
+        ).fetchall()
+        if rows and not API_KEY_SECRET:
+            logger.warning(f"⚠️ {len(rows)} API keys em texto puro mantidas: defina API_KEY_SECRET para convertê-las")
+            return
+        for key_id, key in rows:
+            conn.execute(
+                table.update().where(table.c.id == key_id).values(key=hash_api_key(key))
+            )
+    
+    if rows:
+        logger.info(f"🔑 {len(rows)} API keys convertidas para hash")
+
+
+def hash_verify_tokens():
+    """Preenche verify_token_hash dos clientes criados antes da coluna existir"""
+    table = Client.__table__
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(table.c.id, table.c.verify_token).where(table.c.verify_token_hash == None)
+        ).fetchall()
+        for client_id, verify_token in rows:
+            conn.execute(
+                table.update().where(table.c.id == client_id).values(verify_token_hash=hash_verify_token(verify_token))
+            )
+    
+    if rows:
+        logger.info(f"🔑 verify_token_hash preenchido em {len(rows)} clientes")
+
+
+def normalize_stored_keywords():
+    """Normaliza keywords gravadas antes da normalização na escrita"""
+    from client_manager import normalize_keywords
+    
+    table = Client.__table__
+    with engine.begin() as conn:
+        rows = conn.execute(select(table.c.id, table.c.keywords)).fetchall()
+        updated = 0
+        for client_id, keywords in rows:
+            normalized = normalize_keywords(keywords)
+            if normalized != (keywords or []):
+                conn.execute(
+                    table.update().where(table.c.id == client_id).values(keywords=normalized)
+                )
+                updated += 1
+    
+    if updated:
+        logger.info(f"🔤 Keywords normalizadas em {updated} clientes")
+
+
 def init_db():
     """Inicializa o banco de dados criando todas as tabelas"""
     try:
         Base.metadata.create_all(bind=engine)
+        add_missing_columns()
+        create_missing_indexes()
+        upgrade_postgres_json_columns()
+        hash_plaintext_api_keys()
+        hash_verify_tokens()
+        normalize_stored_keywords()
         logger.info("✅ Banco de dados inicializado com sucesso!")
         return True
     except Exception as e:
@@ -41,11 +231,8 @@ def get_db():
     Dependency para obter sessão do banco
     Usar em rotas FastAPI ou contexto
     """
-    db = SessionLocal()
-    try:
+    with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 def drop_all():
@@ -0,0 +1,31 @@
+"""
+Configuração do gunicorn para produção
+Uso: gunicorn -c gunicorn_conf.py app:app
+"""
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# Processos x threads: o trabalho é dominado por I/O (Graph API e banco)
+# Cada processo tem o próprio pool de conexões: no PostgreSQL o total é
+# workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW), que deve ficar abaixo de max_connections
+# (100 por padrão). Com os valores padrão: 4 x (5 + 5) = 40 conexões no máximo.
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# Carrega o app (e roda init_db) uma vez no master antes do fork
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Cada worker abre suas próprias conexões em vez de herdar as do master"""
+    from database import engine
+    engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    """Antes de o worker sair, conclui o trabalho em background e grava os dados pendentes"""
+    from app import shutdown_background_work
+    shutdown_background_work()
@@ -1,23 +1,72 @@
+import re
 import logging
+from functools import lru_cache
+from typing import Iterable, Optional, Tuple
 from instagram_api import InstagramAPI
-from models import Client
-from client_manager import ClientManager
+from client_manager import ClientManager, ClientSnapshot, queue_message_log
 from sqlalchemy.orm import Session
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=4096)
+def _build_keyword_regex(keywords: Tuple[str, ...]) -> Optional[re.Pattern]:
+    """
+    Compila as keywords do cliente em um único regex (alternância de literais)
+    
+    Uma única busca em C substitui o loop `keyword in texto` por keyword.
+    Em cache pela tupla de keywords: só recompila quando elas mudam.
+    As keywords já são gravadas em minúsculas (client_manager.normalize_keywords).
+    """
+    if not keywords:
+        return None
+    return re.compile('|'.join(re.escape(keyword) for keyword in keywords))
+
+
+def match_reply(table: Iterable[Tuple[Tuple[str, ...], str]], text_lower: str) -> Optional[str]:
+    """Primeira resposta da tabela (em ordem de prioridade) com alguma keyword presente no texto"""
+    for keywords, response in table:
+        if any(keyword in text_lower for keyword in keywords):
+            return response
+    return None
+
+
+# Respostas padrão a mensagens (montadas uma vez, na importação)
+# (keywords, resposta) em ordem de prioridade
+_DEFAULT_RESPONSES: Tuple[Tuple[Tuple[str, ...], str], ...] = (
+    (('oi', 'olá', 'ola', 'hey', 'boa'), "Olá! 👋 Como posso ajudar você hoje?"),
+    (('preço', 'preco', 'valor', 'quanto custa'), "📋 Para informações sobre preços, nossa equipe te enviará todos os detalhes em breve!"),
+    (('horário', 'horario', 'atendimento'), "🕐 Nosso horário de atendimento:\nSeg-Sex: 9h às 18h\nSáb: 9h às 13h"),
+    (('catálogo', 'catalogo', 'produtos'), "📸 Vou te enviar nosso catálogo completo!"),
+    (('contato', 'telefone', 'whatsapp'), "📞 Entre em contato conosco pelos nossos canais oficiais!"),
+)
+_DEFAULT_FALLBACK = "Obrigado pela sua mensagem! 🙂 Em breve retornaremos."
+
+# Respostas a comentários: modelos str.format com {username}
+_COMMENT_RESPONSES: Tuple[Tuple[Tuple[str, ...], str], ...] = (
+    (('preço', 'preco', 'valor'), "@{username} Oi! Enviamos os preços por DM! 📩"),
+    (('orçamento', 'orcamento'), "@{username} Olá! Vamos te enviar um orçamento personalizado por DM! 💼"),
+    (('informação', 'informacao', 'info'), "@{username} Oi! Te enviamos todas as informações por DM! ✉️"),
+    (('contato', 'whatsapp'), "@{username} Te respondemos por DM! 📱"),
+)
+_COMMENT_FALLBACK = "@{username} Olá! Vamos te responder por DM! 😊"
+
+
 class MessageHandler:
     """Gerencia respostas automáticas para mensagens - Multi-tenant"""
     
-    def __init__(self, client: Client, db: Session, client_manager: ClientManager):
+    def __init__(self, client: ClientSnapshot, db: Session, client_manager: ClientManager) -> None:
         self.client = client
         self.db = db
         self.client_manager = client_manager
         self.api = InstagramAPI(client)
+        
+        # Respostas customizadas como tabela de prioridade (keywords já em minúsculas, na ordem do dict)
+        self._custom_responses: Tuple[Tuple[Tuple[str, ...], str], ...] = tuple(
+            ((keyword.lower(),), response) for keyword, response in (client.custom_responses or {}).items()
+        )
     
-    def process_message(self, sender_id: str, message_text: str):
+    def process_message(self, sender_id: str, message_text: str) -> None:
         """
         Processa mensagem recebida e envia resposta personalizada
         
@@ -25,31 +74,22 @@ class MessageHandler:
             sender_id: ID de quem enviou a mensagem
             message_text: Texto da mensagem
         """
-        logger.info(f"[Cliente {self.client.id}] Processando mensagem de {sender_id}: {message_text}")
+        # Verificações baratas antes de qualquer formatação ou processamento do texto
+        if not self.client.auto_reply_enabled:
+            return
         
-        # Verifica rate limit
+        # Reserva o envio no limite diário (toda mensagem recebe resposta)
         if not self.client_manager.check_rate_limit(self.client.id):
-            logger.warning(f"[Cliente {self.client.id}] Limite diário de mensagens excedido!")
+            logger.warning("[Cliente %s] Limite diário de mensagens excedido!", self.client.id)
             return
         
-        # Verifica se auto-reply está habilitado
-        if not self.client.auto_reply_enabled:
-            logger.info(f"[Cliente {self.client.id}] Auto-reply desabilitado")
-            return
+        logger.info("[Cliente %s] Processando mensagem de %s: %s", self.client.id, sender_id, message_text)
         
         # Converte para minúsculo para análise
         text_lower = message_text.lower()
         
-        # Usa respostas personalizadas do cliente se disponíveis
-        custom_responses = self.client.custom_responses or {}
-        
-        response = None
-        
-        # Verifica respostas customizadas primeiro
-        for keyword, custom_response in custom_responses.items():
-            if keyword.lower() in text_lower:
-                response = custom_response
-                break
+        # Verifica respostas customizadas primeiro (a primeira keyword do dict presente no texto)
+        response = match_reply(self._custom_responses, text_lower)
         
         # Se não houver resposta customizada, usa lógica padrão
         if not response:
@@ -59,8 +99,8 @@ class MessageHandler:
         try:
             result = self.api.send_message(sender_id, response)
             
-            # Registra mensagem no banco
-            self.client_manager.log_message(
+            # Registra mensagem (gravada em lote)
+            queue_message_log(
                 client_id=self.client.id,
                 recipient_id=sender_id,
                 message_type='dm',
@@ -68,8 +108,8 @@ class MessageHandler:
                 sent=bool(result)
             )
         except Exception as e:
-            logger.error(f"[Cliente {self.client.id}] Erro ao enviar mensagem: {e}")
-            self.client_manager.log_message(
+            logger.error("[Cliente %s] Erro ao enviar mensagem: %s", self.client.id, e)
+            queue_message_log(
                 client_id=self.client.id,
                 recipient_id=sender_id,
                 message_type='dm',
@@ -80,31 +120,18 @@ class MessageHandler:
     
     def _get_default_response(self, text_lower: str) -> str:
         """Retorna resposta padrão baseada em palavras-chave"""
-        
-        if any(word in text_lower for word in ['oi', 'olá', 'ola', 'hey', 'boa']):
-            return "Olá! 👋 Como posso ajudar você hoje?"
-        
-        elif any(word in text_lower for word in ['preço', 'preco', 'valor', 'quanto custa']):
-            return "📋 Para informações sobre preços, nossa equipe te enviará todos os detalhes em breve!"
-        
-        elif any(word in text_lower for word in ['horário', 'horario', 'atendimento']):
-            return "🕐 Nosso horário de atendimento:\nSeg-Sex: 9h às 18h\nSáb: 9h às 13h"
-        
-        elif any(word in text_lower for word in ['catálogo', 'catalogo', 'produtos']):
-            return "📸 Vou te enviar nosso catálogo completo!"
-        
-        elif any(word in text_lower for word in ['contato', 'telefone', 'whatsapp']):
-            return "📞 Entre em contato conosco pelos nossos canais oficiais!"
-        
-        else:
-            return "Obrigado pela sua mensagem! 🙂 Em breve retornaremos."
+        return match_reply(_DEFAULT_RESPONSES, text_lower) or _DEFAULT_FALLBACK
     
-    def send_media(self, sender_id: str, media_url: str, media_type: str = 'image'):
+    def send_media(self, sender_id: str, media_url: str, media_type: str = 'image') -> Optional[dict]:
         """Envia mídia para destinatário"""
+        if not self.client_manager.check_rate_limit(self.client.id):
+            logger.warning("[Cliente %s] Limite diário de mensagens excedido!", self.client.id)
+            return None
+        
         try:
             result = self.api.send_media(sender_id, media_url, media_type)
             
-            self.client_manager.log_message(
+            queue_message_log(
                 client_id=self.client.id,
                 recipient_id=sender_id,
                 message_type='dm',
@@ -113,20 +140,21 @@ class MessageHandler:
             )
             return result
         except Exception as e:
-            logger.error(f"[Cliente {self.client.id}] Erro ao enviar mídia: {e}")
+            logger.error("[Cliente %s] Erro ao enviar mídia: %s", self.client.id, e)
             return None
 
 
 class CommentHandler:
     """Gerencia respostas automáticas para comentários - Multi-tenant"""
     
-    def __init__(self, client: Client, db: Session, client_manager: ClientManager):
+    def __init__(self, client: ClientSnapshot, db: Session, client_manager: ClientManager) -> None:
         self.client = client
         self.db = db
         self.client_manager = client_manager
         self.api = InstagramAPI(client)
+        self._kw_re: Optional[re.Pattern] = _build_keyword_regex(tuple(client.keywords or ()))
     
-    def process_comment(self, comment_id: str, comment_text: str, username: str):
+    def process_comment(self, comment_id: str, comment_text: str, username: str) -> None:
         """
         Processa comentário e responde se contiver palavras-chave do cliente
         
@@ -135,30 +163,30 @@ class CommentHandler:
             comment_text: Texto do comentário
             username: Usuário que comentou
         """
-        logger.info(f"[Cliente {self.client.id}] Processando comentário de @{username}: {comment_text}")
-        
-        # Verifica rate limit
-        if not self.client_manager.check_rate_limit(self.client.id):
-            logger.warning(f"[Cliente {self.client.id}] Limite diário de mensagens excedido!")
+        # Verificações baratas antes de qualquer formatação ou processamento do texto
+        # (o envio só é reservado no limite se o comentário tiver keywords)
+        if not self.client.auto_reply_enabled or self.client_manager.is_rate_limited(self.client.id):
             return
         
-        # Verifica se auto-reply está habilitado
-        if not self.client.auto_reply_enabled:
-            return
+        logger.info("[Cliente %s] Processando comentário de @%s: %s", self.client.id, username, comment_text)
         
         text_lower = comment_text.lower()
         
-        # Usa keywords do cliente
-        client_keywords = self.client.keywords or []
-        should_reply = any(keyword.lower() in text_lower for keyword in client_keywords)
+        # Usa keywords do cliente (regex compilado e reaproveitado)
+        should_reply = self._kw_re is not None and self._kw_re.search(text_lower) is not None
         
         if should_reply:
             response = self._generate_comment_response(text_lower, username)
             
+            # Reserva o envio no limite diário
+            if not self.client_manager.check_rate_limit(self.client.id):
+                logger.warning("[Cliente %s] Limite diário de mensagens excedido!", self.client.id)
+                return
+            
             try:
                 result = self.api.reply_to_comment(comment_id, response)
                 
-                self.client_manager.log_message(
+                queue_message_log(
                     client_id=self.client.id,
                     recipient_id=username,
                     message_type='comment',
@@ -166,53 +194,44 @@ class CommentHandler:
                     sent=bool(result)
                 )
                 
-                logger.info(f"[Cliente {self.client.id}] Resposta enviada ao comentário {comment_id}")
+                logger.info("[Cliente %s] Resposta enviada ao comentário %s", self.client.id, comment_id)
             except Exception as e:
-                logger.error(f"[Cliente {self.client.id}] Erro ao responder comentário: {e}")
+                logger.error("[Cliente %s] Erro ao responder comentário: %s", self.client.id, e)
         else:
-            logger.info(f"[Cliente {self.client.id}] Comentário não contém keywords configuradas")
+            logger.info("[Cliente %s] Comentário não contém keywords configuradas", self.client.id)
     
     def _generate_comment_response(self, text_lower: str, username: str) -> str:
         """Gera resposta personalizada para comentário"""
-        
-        if any(word in text_lower for word in ['preço', 'preco', 'valor']):
-            return f"@{username} Oi! Enviamos os preços por DM! 📩"
-        
-        elif any(word in text_lower for word in ['orçamento', 'orcamento']):
-            return f"@{username} Olá! Vamos te enviar um orçamento personalizado por DM! 💼"
-        
-        elif any(word in text_lower for word in ['informação', 'informacao', 'info']):
-            return f"@{username} Oi! Te enviamos todas as informações por DM! ✉️"
-        
-        elif any(word in text_lower for word in ['contato', 'whatsapp']):
-            return f"@{username} Te respondemos por DM! 📱"
-        
-        else:
-            return f"@{username} Olá! Vamos te responder por DM! 😊"
+        template = match_reply(_COMMENT_RESPONSES, text_lower) or _COMMENT_FALLBACK
+        return template.format(username=username)
 
 
 class StoryMentionHandler:
     """Gerencia menções em stories - Multi-tenant"""
     
-    def __init__(self, client: Client, db: Session, client_manager: ClientManager):
+    def __init__(self, client: ClientSnapshot, db: Session, client_manager: ClientManager) -> None:
         self.client = client
         self.db = db
         self.client_manager = client_manager
         self.api = InstagramAPI(client)
     
-    def process_mention(self, sender_id: str, media_id: str):
+    def process_mention(self, sender_id: str, media_id: str) -> None:
         """Processa menção em story"""
-        logger.info(f"[Cliente {self.client.id}] Menção em story de {sender_id}")
-        
         if not self.client.auto_reply_enabled:
             return
         
+        if not self.client_manager.check_rate_limit(self.client.id):
+            logger.warning("[Cliente %s] Limite diário de mensagens excedido!", self.client.id)
+            return
+        
+        logger.info("[Cliente %s] Menção em story de %s", self.client.id, sender_id)
+        
         response = "Obrigado por compartilhar! 🙏✨"
         
         try:
             result = self.api.send_message(sender_id, response)
             
-            self.client_manager.log_message(
+            queue_message_log(
                 client_id=self.client.id,
                 recipient_id=sender_id,
                 message_type='story_mention',
@@ -220,4 +239,4 @@ class StoryMentionHandler:
                 sent=bool(result)
             )
         except Exception as e:
-            logger.error(f"[Cliente {self.client.id}] Erro ao responder menção: {e}")
+            logger.error("[Cliente %s] Erro ao responder menção: %s", self.client.id, e)
@@ -1,42 +1,71 @@
+import os
+import orjson
 import requests
 import logging
-from models import Client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from client_manager import ClientSnapshot
 from typing import Optional
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _create_session() -> requests.Session:
+    """
+    Sessão HTTP compartilhada por todos os clientes
+    
+    Mantém conexões keep-alive com a Graph API (sem novo handshake TLS a cada
+    chamada). Falhas de conexão e erros 5xx em requisições idempotentes são
+    repetidos; POSTs não são reenviados após uma resposta, para não duplicar mensagens.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=int(os.getenv('GRAPH_API_POOL_SIZE', 64)),
+        max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504))
+    )
+    session.mount('https://', adapter)
+    return session
+
+
+_SESSION = _create_session()
+
+
 class InstagramAPI:
     """Classe para interagir com a Instagram Graph API - Multi-tenant"""
     
-    def __init__(self, client: Client):
+    def __init__(self, client: ClientSnapshot):
         """
         Inicializa API com credenciais do cliente
         
         Args:
-            client: Objeto Client do banco de dados
+            client: Snapshot do cliente (ClientSnapshot), usado fora da sessão
         """
         self.client = client
         self.base_url = 'https://graph.facebook.com/v18.0'
         self.access_token = client.access_token
         self.account_id = client.instagram_account_id
+        self._session = _SESSION
+        # Token vai no header (a sessão é compartilhada entre clientes)
+        self._headers = {'Authorization': f"Bearer {client.access_token}"}
+        self._json_headers = {**self._headers, 'Content-Type': 'application/json'}
     
     def _make_request(self, method, endpoint, **kwargs):
         """Faz requisição para a API"""
         url = f"{self.base_url}/{endpoint}"
         
-        # Adiciona access_token aos parâmetros
-        params = kwargs.get('params', {})
-        params['access_token'] = self.access_token
-        kwargs['params'] = params
+        # Corpo JSON serializado com orjson (em vez do json da stdlib usado por requests)
+        headers = self._headers
+        if 'json' in kwargs:
+            kwargs['data'] = orjson.dumps(kwargs.pop('json'))
+            headers = self._json_headers
         
         try:
-            response = requests.request(method, url, **kwargs)
+            response = self._session.request(method, url, headers=headers, **kwargs)
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[Cliente {self.client.id}] Erro na requisição: {e}")
+            return orjson.loads(response.content)
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            logger.error("[Cliente %s] Erro na requisição: %s", self.client.id, e)
             return None
     
     def send_message(self, recipient_id, message_text):
@@ -50,7 +79,7 @@ class InstagramAPI:
         
         result = self._make_request('POST', endpoint, json=data)
         if result:
-            logger.info(f"[Cliente {self.client.id}] Mensagem enviada para {recipient_id}")
+            logger.info("[Cliente %s] Mensagem enviada para %s", self.client.id, recipient_id)
         return result
     
     def send_media(self, recipient_id, media_url, media_type='image'):
@@ -76,7 +105,7 @@ class InstagramAPI:
         
         result = self._make_request('POST', endpoint, json=data)
         if result:
-            logger.info(f"[Cliente {self.client.id}] Mídia ({media_type}) enviada para {recipient_id}")
+            logger.info("[Cliente %s] Mídia (%s) enviada para %s", self.client.id, media_type, recipient_id)
         return result
     
     def send_file(self, recipient_id, file_url):
@@ -97,7 +126,7 @@ class InstagramAPI:
         
         result = self._make_request('POST', endpoint, params=data)
         if result:
-            logger.info(f"[Cliente {self.client.id}] Resposta enviada ao comentário {comment_id}")
+            logger.info("[Cliente %s] Resposta enviada ao comentário %s", self.client.id, comment_id)
         return result
     
     def get_comment_details(self, comment_id):
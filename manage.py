@@ -3,7 +3,13 @@
 Script para inicializar banco de dados e gerenciar clientes
 """
 import sys
+import logging
 import argparse
+from dotenv import load_dotenv
+
+# Carrega o .env antes dos módulos que leem variáveis de ambiente na importação
+load_dotenv()
+
 from database import init_db, reset_db, SessionLocal
 from client_manager import ClientManager
 
@@ -46,68 +52,63 @@ def add_client_cli():
     daily_limit = input("Limite diário de mensagens (padrão 1000): ")
     daily_limit = int(daily_limit) if daily_limit else 1000
     
-    # Cria cliente
-    db = SessionLocal()
-    manager = ClientManager(db)
-    
-    try:
-        client = manager.create_client(
-            name=name,
-            email=email,
-            access_token=access_token,
-            instagram_account_id=instagram_account_id,
-            page_id=page_id,
-            keywords=keywords,
-            daily_limit=daily_limit
-        )
-        
-        # Gera API Key
-        api_key = manager.generate_api_key(client.id, "CLI Generated")
+    # Cria cliente (a sessão é fechada ao sair do bloco)
+    with SessionLocal() as db:
+        manager = ClientManager(db)
         
-        print("\n✅ Cliente criado com sucesso!")
-        print("=" * 50)
-        print(f"ID: {client.id}")
-        print(f"Nome: {client.name}")
-        print(f"Email: {client.email}")
-        print(f"Keywords: {', '.join(client.keywords)}")
-        print(f"\n🔑 API Key: {api_key.key}")
-        print(f"\n🔗 Webhook URL: /webhook/{client.verify_token}")
-        print(f"🔐 Verify Token: {client.verify_token}")
-        print("=" * 50)
-        
-    except Exception as e:
-        print(f"\n❌ Erro ao criar cliente: {e}")
-    finally:
-        db.close()
+        try:
+            client = manager.create_client(
+                name=name,
+                email=email,
+                access_token=access_token,
+                instagram_account_id=instagram_account_id,
+                page_id=page_id,
+                keywords=keywords,
+                daily_limit=daily_limit
+            )
+            
+            # Gera API Key
+            api_key = manager.generate_api_key(client.id, "CLI Generated")
+            
+            print("\n✅ Cliente criado com sucesso!")
+            print("=" * 50)
+            print(f"ID: {client.id}")
+            print(f"Nome: {client.name}")
+            print(f"Email: {client.email}")
+            print(f"Keywords: {', '.join(client.keywords)}")
+            print(f"\n🔑 API Key: {api_key}")
+            print(f"\n🔗 Webhook URL: /webhook/{client.verify_token}")
+            print(f"🔐 Verify Token: {client.verify_token}")
+            print("=" * 50)
+            
+        except Exception as e:
+            print(f"\n❌ Erro ao criar cliente: {e}")
 
 
 def list_clients_cli():
     """Lista todos os clientes"""
-    db = SessionLocal()
-    manager = ClientManager(db)
-    
-    clients = manager.list_clients(active_only=False)
-    
-    if not clients:
-        print("\n📋 Nenhum cliente cadastrado")
-        db.close()
-        return
-    
-    print("\n📋 Clientes Cadastrados")
-    print("=" * 80)
-    
-    for client in clients:
-        status = "✅ Ativo" if client.active else "❌ Inativo"
-        print(f"\nID: {client.id} | {status}")
-        print(f"Nome: {client.name}")
-        print(f"Email: {client.email}")
-        print(f"Instagram ID: {client.instagram_account_id}")
-        print(f"Keywords: {', '.join(client.keywords)}")
-        print(f"Limite diário: {client.daily_message_limit}")
-        print(f"Mensagens hoje: {client.messages_sent_today}")
-        print("-" * 80)
-    
-    db.close()
+    with SessionLocal() as db:
+        manager = ClientManager(db)
+        
+        clients = manager.list_clients(active_only=False)
+        
+        if not clients:
+            print("\n📋 Nenhum cliente cadastrado")
+            return
+        
+        print("\n📋 Clientes Cadastrados")
+        print("=" * 80)
+        
+        for client in clients:
+            status = "✅ Ativo" if client.active else "❌ Inativo"
+            print(f"\nID: {client.id} | {status}")
+            print(f"Nome: {client.name}")
+            print(f"Email: {client.email}")
+            print(f"Instagram ID: {client.instagram_account_id}")
+            print(f"Keywords: {', '.join(client.keywords)}")
+            print(f"Limite diário: {client.daily_message_limit}")
+            print(f"Mensagens hoje: {client.messages_sent_today}")
+            print("-" * 80)
 
 
 def get_client_stats_cli():
@@ -120,29 +121,26 @@ def get_client_stats_cli():
         print("❌ ID inválido")
         return
     
-    db = SessionLocal()
-    manager = ClientManager(db)
-    
-    stats = manager.get_client_stats(client_id)
-    
-    if not stats:
-        print(f"❌ Cliente {client_id} não encontrado")
-        db.close()
-        return
-    
-    print("\n📊 Estatísticas do Cliente")
-    print("=" * 50)
-    print(f"ID: {stats['client_id']}")
-    print(f"Nome: {stats['name']}")
-    print(f"Status: {'✅ Ativo' if stats['active'] else '❌ Inativo'}")
-    print(f"\nTotal de mensagens: {stats['total_messages']}")
-    print(f"Mensagens hoje: {stats['messages_today']}")
-    print(f"Webhooks recebidos: {stats['webhooks_received']}")
-    print(f"\nLimite diário: {stats['daily_limit']}")
-    print(f"Restante hoje: {stats['limit_remaining']}")
-    print("=" * 50)
-    
-    db.close()
+    with SessionLocal() as db:
+        manager = ClientManager(db)
+        
+        stats = manager.get_client_stats(client_id)
+        
+        if not stats:
+            print(f"❌ Cliente {client_id} não encontrado")
+            return
+        
+        print("\n📊 Estatísticas do Cliente")
+        print("=" * 50)
+        print(f"ID: {stats['client_id']}")
+        print(f"Nome: {stats['name']}")
+        print(f"Status: {'✅ Ativo' if stats['active'] else '❌ Inativo'}")
+        print(f"\nTotal de mensagens: {stats['total_messages']}")
+        print(f"Mensagens hoje: {stats['messages_today']}")
+        print(f"Webhooks recebidos: {stats['webhooks_received']}")
+        print(f"\nLimite diário: {stats['daily_limit']}")
+        print(f"Restante hoje: {stats['limit_remaining']}")
+        print("=" * 50)
 
 
 def deactivate_client_cli():
@@ -160,18 +158,42 @@ def deactivate_client_cli():
         print("❌ Operação cancelada")
         return
     
-    db = SessionLocal()
-    manager = ClientManager(db)
+    with SessionLocal() as db:
+        manager = ClientManager(db)
+        
+        if manager.deactivate_client(client_id):
+            print(f"✅ Cliente {client_id} desativado com sucesso")
+        else:
+            print(f"❌ Cliente {client_id} não encontrado")
+
+
+def new_api_key_cli(client_id=None):
+    """Gera uma nova API key para um cliente existente"""
+    if client_id is None:
+        client_id = input("\nDigite o ID do cliente: ")
     
-    if manager.deactivate_client(client_id):
-        print(f"✅ Cliente {client_id} desativado com sucesso")
-    else:
-        print(f"❌ Cliente {client_id} não encontrado")
+    try:
+        client_id = int(client_id)
+    except ValueError:
+        print("❌ ID inválido")
+        return
     
-    db.close()
+    with SessionLocal() as db:
+        manager = ClientManager(db)
+        
+        if not manager.get_client(client_id):
+            print(f"❌ Cliente {client_id} não encontrado")
+            return
+        
+        api_key = manager.generate_api_key(client_id, "CLI Generated")
+        
+        print(f"\n🔑 Nova API Key do cliente {client_id}: {api_key}")
+        print("Guarde a key agora: só o hash é armazenado, ela não pode ser recuperada depois.")
 
 
 def main():
+    logging.basicConfig(level=logging.INFO)
+    
     parser = argparse.ArgumentParser(description='Instagram Agent - Gerenciamento')
     parser.add_argument('action', choices=[
         'init',
@@ -179,8 +201,10 @@ def main():
         'add-client',
         'list-clients',
         'stats',
-        'deactivate'
+        'deactivate',
+        'new-key'
     ], help='Ação a ser executada')
+    parser.add_argument('client_id', nargs='?', help='ID do cliente (new-key)')
     
     args = parser.parse_args()
     
@@ -196,6 +220,8 @@ def main():
         get_client_stats_cli()
     elif args.action == 'deactivate':
         deactivate_client_cli()
+    elif args.action == 'new-key':
+        new_api_key_cli(args.client_id)
 
 
 if __name__ == '__main__':
@@ -208,6 +234,7 @@ if __name__ == '__main__':
         print("  python manage.py list-clients   - Lista todos os clientes")
         print("  python manage.py stats          - Estatísticas de um cliente")
         print("  python manage.py deactivate     - Desativa cliente")
+        print("  python manage.py new-key <id>   - Gera nova API key para um cliente")
         print("  python manage.py reset          - Reseta banco (CUIDADO!)")
         print("=" * 50)
         print()
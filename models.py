@@ -1,10 +1,26 @@
+import hashlib
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, JSON
+import orjson
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, JSON, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import validates
 
 Base = declarative_base()
 
 
+def hash_verify_token(token: str) -> str:
+    """
+    Hash BLAKE2b do verify_token, usado como chave de busca (índice menor que o token)
+    Sem segredo: o token continua gravado para montar a URL do webhook
+    """
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+
+# JSON genérico; no PostgreSQL vira JSONB (armazenado já decomposto)
+JSONVariant = JSON().with_variant(JSONB(), 'postgresql')
+
+
 class Client(Base):
     """Modelo de Cliente - cada cliente representa uma conta Instagram"""
     __tablename__ = 'clients'
@@ -19,14 +35,15 @@ class Client(Base):
     page_id = Column(String(255), nullable=False)
     
     # Webhook
-    verify_token = Column(String(255), nullable=False)  # Token único por cliente
+    verify_token = Column(String(255), nullable=False)  # Token único por cliente (garantido pelo índice único de verify_token_hash)
+    verify_token_hash = Column(String(32), unique=True, index=True)  # BLAKE2b do token: usado nas buscas
     
     # Configurações personalizadas
-    keywords = Column(JSON, default=list)  # Lista de keywords para monitorar
+    keywords = Column(JSONVariant, default=list)  # Lista de keywords para monitorar
     auto_reply_enabled = Column(Boolean, default=True)  # Auto-resposta ativada
     
     # Mensagens personalizadas (JSON)
-    custom_responses = Column(JSON, default=dict)  # Respostas customizadas
+    custom_responses = Column(JSONVariant, default=dict)  # Respostas customizadas
     
     # Status e controle
     active = Column(Boolean, default=True)  # Cliente ativo/inativo
@@ -38,28 +55,42 @@ class Client(Base):
     messages_sent_today = Column(Integer, default=0)
     last_reset_date = Column(DateTime, default=datetime.utcnow)
     
+    # Contadores agregados (mantidos na escrita, evitam COUNT(*) nas estatísticas)
+    total_messages = Column(Integer, default=0, server_default='0')
+    webhooks_received = Column(Integer, default=0, server_default='0')
+    
+    # Campos expostos pela API (to_dict/to_json e listagem), na ordem da resposta
+    API_FIELDS = (
+        'id', 'name', 'email', 'instagram_account_id', 'keywords', 'auto_reply_enabled',
+        'active', 'created_at', 'daily_message_limit', 'messages_sent_today'
+    )
+    
+    @validates('verify_token')
+    def _sync_verify_token_hash(self, key, verify_token):
+        """Mantém verify_token_hash em dia sempre que o token é atribuído (criação ou update)"""
+        self.verify_token_hash = hash_verify_token(verify_token) if verify_token else None
+        return verify_token
+    
     def __repr__(self):
         return f"<Client(id={self.id}, name='{self.name}', email='{self.email}')>"
     
     def to_dict(self):
         """Converte para dicionário (para API)"""
-        return {
-            'id': self.id,
-            'name': self.name,
-            'email': self.email,
-            'instagram_account_id': self.instagram_account_id,
-            'keywords': self.keywords,
-            'auto_reply_enabled': self.auto_reply_enabled,
-            'active': self.active,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'daily_message_limit': self.daily_message_limit,
-            'messages_sent_today': self.messages_sent_today
-        }
+        data = {field: getattr(self, field) for field in self.API_FIELDS}
+        data['created_at'] = self.created_at.isoformat() if self.created_at else None
+        return data
+    
+    def to_json(self) -> bytes:
+        """Mesmo conteúdo de to_dict(), já serializado com orjson (que converte o datetime em C)"""
+        return orjson.dumps({field: getattr(self, field) for field in self.API_FIELDS})
 
 
 class Message(Base):
     """Histórico de mensagens enviadas"""
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_msg_client_created', 'client_id', 'created_at'),  # Mensagens por cliente (delete_client)
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     client_id = Column(Integer, nullable=False)  # FK para Client
@@ -84,6 +115,9 @@ class Message(Base):
 class Webhook(Base):
     """Log de webhooks recebidos"""
     __tablename__ = 'webhooks'
+    __table_args__ = (
+        Index('ix_webhook_client', 'client_id'),  # Webhooks por cliente (delete_client)
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     client_id = Column(Integer)  # FK para Client (pode ser null se não identificado)
@@ -111,7 +145,8 @@ class ApiKey(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     client_id = Column(Integer, nullable=False)  # FK para Client
     
-    key = Column(String(255), unique=True, nullable=False)  # API Key
+    # Hash BLAKE2b da API key (a key em si só é exibida na criação, nunca armazenada)
+    key_hash = Column('key', String(255), unique=True, nullable=False)
     name = Column(String(255))  # Nome/descrição da chave
     
     active = Column(Boolean, default=True)
@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+
+# Banco SQLite temporário e segredo fixo, definidos antes de importar os módulos do app
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ['API_KEY_SECRET'] = 'test-secret'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import client_manager
+from database import SessionLocal, engine, init_db
+from client_manager import ClientManager
+from models import Base
+
+init_db()
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """Cada teste começa com tabelas, caches e filas em memória vazios"""
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+    
+    for cache in (
+        client_manager._API_KEY_CACHE, client_manager._API_KEY_USAGE,
+        client_manager._COUNTER_DELTAS, client_manager._CLIENT_CACHE,
+        client_manager._VERIFY_TOKEN_CACHE, client_manager._STATS_CACHE,
+        client_manager._RATE_LIMITED
+    ):
+        cache.clear()
+    for pending in (client_manager._MESSAGE_LOG_QUEUE, client_manager._WEBHOOK_LOG_QUEUE):
+        client_manager._drain_queue(pending)
+
+
+@pytest.fixture
+def db():
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def manager(db):
+    return ClientManager(db)
+
+
+@pytest.fixture
+def client(manager):
+    return manager.create_client(
+        name='Loja',
+        email='loja@example.com',
+        access_token='token',
+        instagram_account_id='123',
+        page_id='456',
+        keywords=['Preço', 'oi'],
+        daily_limit=2
+    )
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+import client_manager
+from client_manager import ClientManager, queue_message_log
+from database import SessionLocal
+from models import Client, Message
+
+
+def test_deactivation_evicts_cached_client(manager, client):
+    api_key = manager.generate_api_key(client.id)
+    assert manager.validate_api_key(api_key).id == client.id
+    assert manager.get_client_by_verify_token(client.verify_token).id == client.id
+    
+    manager.deactivate_client(client.id)
+    
+    assert manager.validate_api_key(api_key) is None
+    assert manager.get_client_cached(client.id).active is False
+
+
+def test_rotated_verify_token_is_evicted(manager, client):
+    old_token = client.verify_token
+    assert manager.get_client_by_verify_token(old_token).id == client.id
+    
+    manager.update_client(client.id, verify_token='novo-token')
+    
+    assert manager.get_client_by_verify_token(old_token) is None
+    assert manager.get_client_by_verify_token('novo-token').id == client.id
+
+
+def test_rollback_keeps_cache(manager, db, client):
+    snapshot = manager.get_client_cached(client.id)
+    
+    client.name = 'Outro nome'
+    db.flush()
+    db.rollback()
+    
+    assert manager.get_client_cached(client.id) is snapshot
+
+
+def test_flush_requeues_batch_on_database_error(manager, db, client, monkeypatch):
+    queue_message_log(client_id=client.id, recipient_id='789', message_type='dm', message_text='Olá')
+    
+    def fail(*args, **kwargs):
+        raise OperationalError('INSERT INTO messages', {}, Exception('server closed the connection'))
+    
+    monkeypatch.setattr(db, 'execute', fail)
+    with pytest.raises(OperationalError):
+        manager.flush_message_logs()
+    monkeypatch.undo()
+    
+    assert manager.flush_message_logs() == 1
+    manager.flush_counters()
+    db.expire_all()
+    assert db.get(Client, client.id).total_messages == 1
+
+
+def test_flush_drops_only_invalid_rows(manager, db, client):
+    queue_message_log(client_id=client.id, recipient_id='789', message_type='dm', message_text='Olá')
+    queue_message_log(client_id=client.id, recipient_id=None, message_type='dm', message_text='Sem destinatário')
+    
+    assert manager.flush_message_logs() == 1
+    assert db.execute(select(Message.message_text)).scalars().all() == ['Olá']
+    assert client_manager._MESSAGE_LOG_QUEUE.empty()
+
+
+def test_check_rate_limit_resets_on_new_day(manager, db, client, monkeypatch):
+    assert manager.check_rate_limit(client.id)
+    assert manager.check_rate_limit(client.id)
+    assert not manager.check_rate_limit(client.id)
+    
+    class Tomorrow(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime.utcnow() + timedelta(days=1)
+    
+    monkeypatch.setattr(client_manager, 'datetime', Tomorrow)
+    
+    assert manager.check_rate_limit(client.id)
+    db.expire_all()
+    assert db.get(Client, client.id).messages_sent_today == 1
@@ -0,0 +1,109 @@
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.orm import Session
+
+import database
+from client_manager import ClientManager, hash_api_key
+from models import ApiKey, Client, hash_verify_token
+
+# Esquema criado pela primeira versão dos modelos (bancos já em produção)
+BASELINE_SCHEMA = (
+    """
+    CREATE TABLE clients (
+        id INTEGER NOT NULL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        email VARCHAR(255) NOT NULL UNIQUE,
+        access_token TEXT NOT NULL,
+        instagram_account_id VARCHAR(255) NOT NULL,
+        page_id VARCHAR(255) NOT NULL,
+        verify_token VARCHAR(255) NOT NULL,
+        keywords JSON,
+        auto_reply_enabled BOOLEAN,
+        custom_responses JSON,
+        active BOOLEAN,
+        created_at DATETIME,
+        updated_at DATETIME,
+        daily_message_limit INTEGER,
+        messages_sent_today INTEGER,
+        last_reset_date DATETIME
+    )
+    """,
+    """
+    CREATE TABLE messages (
+        id INTEGER NOT NULL PRIMARY KEY,
+        client_id INTEGER NOT NULL,
+        recipient_id VARCHAR(255) NOT NULL,
+        message_type VARCHAR(50) NOT NULL,
+        message_text TEXT,
+        media_url VARCHAR(500),
+        sent BOOLEAN,
+        error TEXT,
+        created_at DATETIME
+    )
+    """,
+    """
+    CREATE TABLE webhooks (
+        id INTEGER NOT NULL PRIMARY KEY,
+        client_id INTEGER,
+        event_type VARCHAR(50) NOT NULL,
+        payload JSON NOT NULL,
+        processed BOOLEAN,
+        error TEXT,
+        received_at DATETIME,
+        processed_at DATETIME
+    )
+    """,
+    """
+    CREATE TABLE api_keys (
+        id INTEGER NOT NULL PRIMARY KEY,
+        client_id INTEGER NOT NULL,
+        "key" VARCHAR(255) NOT NULL UNIQUE,
+        name VARCHAR(255),
+        active BOOLEAN,
+        created_at DATETIME,
+        last_used_at DATETIME
+    )
+    """,
+)
+
+BASELINE_ROWS = (
+    """
+    INSERT INTO clients (id, name, email, access_token, instagram_account_id, page_id,
+                         verify_token, keywords, auto_reply_enabled, custom_responses, active,
+                         daily_message_limit, messages_sent_today)
+    VALUES (1, 'Loja', 'loja@example.com', 'token', '123', '456',
+            'token-antigo', '[" Preço ", "OI"]', 1, '{}', 1, 1000, 0)
+    """,
+    "INSERT INTO messages (client_id, recipient_id, message_type) VALUES (1, '789', 'dm'), (1, '790', 'dm')",
+    "INSERT INTO webhooks (client_id, event_type, payload) VALUES (1, 'instagram_event', '{}')",
+    "INSERT INTO api_keys (id, client_id, \"key\", active) VALUES (1, 1, 'sk_antiga', 1)",
+)
+
+
+def test_init_db_upgrades_baseline_database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA + BASELINE_ROWS:
+            conn.execute(text(statement))
+    monkeypatch.setattr(database, 'engine', engine)
+    
+    assert database.init_db()
+    
+    indexes = {index['name'] for index in inspect(engine).get_indexes('clients')}
+    assert 'ix_clients_verify_token_hash' in indexes
+    
+    with Session(engine) as db:
+        client = db.get(Client, 1)
+        assert client.total_messages == 2
+        assert client.webhooks_received == 1
+        assert client.verify_token_hash == hash_verify_token('token-antigo')
+        assert client.keywords == ['preço', 'oi']
+        assert db.execute(select(ApiKey.key_hash)).scalar() == hash_api_key('sk_antiga')
+        
+        manager = ClientManager(db)
+        assert manager.validate_api_key('sk_antiga').id == 1
+        assert manager.get_client_by_verify_token('token-antigo').id == 1
+    
+    # Rodar de novo não altera nada (bancos já atualizados)
+    assert database.init_db()
+    with Session(engine) as db:
+        assert db.execute(select(ApiKey.key_hash)).scalar() == hash_api_key('sk_antiga')